@@ -0,0 +1,17 @@
+# Alert rules shared by the live market cap sweep in bot1.py and the backtest
+
+# Gain multiples announced, in ascending order; one is announced per sweep at most
+MULTIPLES_TO_CHECK = [5, 7, 10, 15, 20, 25, 50, 100, 200, 250, 300, 400, 500]
+
+def in_buy_zone(market_cap, try_buy_at_min, try_buy_at_max):
+    return market_cap >= try_buy_at_min and market_cap <= try_buy_at_max
+
+def multiple_to_notify(market_cap, initial_market_cap, last_notified_multiple, multiples=MULTIPLES_TO_CHECK):
+    """Return the next multiple to announce, or None if no new multiple was reached."""
+    if not initial_market_cap or initial_market_cap <= 0:
+        return None
+    multiple = market_cap / initial_market_cap
+    for m in multiples:
+        if multiple >= m and last_notified_multiple < m:
+            return m
+    return None
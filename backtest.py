@@ -0,0 +1,258 @@
+import csv
+import sys
+import logging
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+import alert_rules
+from watchlist_io import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+HISTORY_FETCH_SIZE = 50000
+
+# ----- LOADING -----
+def load_tokens():
+    """Return token rules keyed by id: name, buy range and stored initial market cap."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT id, token_name, try_buy_at_min, try_buy_at_max, initial_market_cap FROM token_details"
+        )
+        return {
+            row['id']: {
+                'token_name': row['token_name'],
+                'try_buy_at_min': float(row['try_buy_at_min']),
+                'try_buy_at_max': float(row['try_buy_at_max']),
+                'initial_market_cap': float(row['initial_market_cap'] or 0),
+            }
+            for row in cursor.fetchall()
+        }
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def load_history(since=None, until=None):
+    """Stream market_cap_history into (token_ids, epoch seconds, market caps) arrays sorted by token and time."""
+    where = []
+    params = []
+    if since:
+        where.append("recorded_at >= %s")
+        params.append(since)
+    if until:
+        where.append("recorded_at < %s")
+        params.append(until)
+    query = (
+        "SELECT token_id, TIMESTAMPDIFF(SECOND, '1970-01-01', recorded_at), market_cap FROM market_cap_history"
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY token_id, recorded_at"
+    )
+
+    chunks = []
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(HISTORY_FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    history = np.concatenate(chunks)
+    return history[:, 0].astype(np.int64), history[:, 1], history[:, 2]
+
+# ----- SIMULATION -----
+def sample_polls(times, market_caps, interval):
+    """Market caps a poller would have seen every `interval` seconds: the latest
+    recorded quote at each poll. With no interval every recorded quote is a poll."""
+    if not interval:
+        return times, market_caps
+    polls = np.arange(times[0], times[-1] + 1, interval)
+    latest = np.searchsorted(times, polls, side='right') - 1
+    return polls, market_caps[latest]
+
+def replay_token(times, market_caps, rules, multiples, initial_mode='first'):
+    """Replay the buy zone and multiple rules of check_market_caps_for_all_tokens over one
+    token's polls. Returns the (alert, poll index, level) events plus the per-poll
+    in-zone mask and gain ratio they were derived from.
+
+    The rules are applied exactly as in the live sweep: the buy zone fires once and
+    resets the initial market cap from the next poll on, and at most one multiple
+    (the next one above the last announced) fires per poll.
+    """
+    events = []
+    initial = market_caps[0] if initial_mode == 'first' else rules['initial_market_cap']
+
+    in_zone = (market_caps >= rules['try_buy_at_min']) & (market_caps <= rules['try_buy_at_max'])
+    zone_hits = np.flatnonzero(in_zone)
+    effective_initial = np.full(len(market_caps), initial)
+    if len(zone_hits):
+        buy_index = zone_hits[0]
+        events.append(('buy_zone', buy_index, None))
+        effective_initial[buy_index + 1:] = market_caps[buy_index]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(effective_initial > 0, market_caps / effective_initial, 0.0)
+    # Highest multiple level reached at each poll (0 = below the first multiple)
+    reached = np.searchsorted(multiples, ratio, side='right')
+
+    level = 0  # last_notified_multiple starts at 1, below every multiple
+    position = 0
+    while level < len(multiples):
+        hits = np.flatnonzero(reached[position:] > level)
+        if not len(hits):
+            break
+        position += hits[0]
+        events.append(('multiple', position, multiples[level]))
+        level += 1
+        position += 1
+    return events, in_zone, ratio
+
+def catch_window(times, condition, index):
+    """Seconds the condition stayed true from the alert at `index`; a poll interval up
+    to this long is guaranteed to see it. None if it was still true at the end."""
+    ends = np.flatnonzero(~condition[index:])
+    if not len(ends):
+        return None
+    return float(times[index + ends[0]] - times[index])
+
+def run_backtest(tokens, token_ids, times, market_caps, interval=None, multiples=alert_rules.MULTIPLES_TO_CHECK,
+                 initial_mode='first'):
+    """Replay every token at full history resolution and at `interval`. Returns a list of alerts."""
+    multiples = np.asarray(sorted(multiples), dtype=np.float64)
+    boundaries = np.flatnonzero(np.diff(token_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(token_ids)]])
+
+    alerts = []
+    for start, end in zip(starts, ends):
+        token_id = int(token_ids[start])
+        rules = tokens.get(token_id)
+        if rules is None:
+            continue
+        token_times, token_caps = times[start:end], market_caps[start:end]
+
+        # Full resolution replay gives the window each alert was catchable in
+        raw_events, in_zone, ratio = replay_token(token_times, token_caps, rules, multiples, initial_mode)
+        windows = {}
+        for alert, index, level in raw_events:
+            condition = in_zone if alert == 'buy_zone' else ratio >= level
+            windows[(alert, level)] = catch_window(token_times, condition, index)
+
+        poll_times, poll_caps = sample_polls(token_times, token_caps, interval)
+        polled_events, _, _ = replay_token(poll_times, poll_caps, rules, multiples, initial_mode)
+        polled = {(alert, level): index for alert, index, level in polled_events}
+
+        for alert, index, level in raw_events:
+            polled_index = polled.get((alert, level))
+            alerts.append({
+                'token_id': token_id,
+                'token_name': rules['token_name'],
+                'alert': 'buy_zone' if alert == 'buy_zone' else f"{level:g}x",
+                'first_possible_at': float(token_times[index]),
+                'fired_at': float(poll_times[polled_index]) if polled_index is not None else None,
+                'market_cap': float(poll_caps[polled_index]) if polled_index is not None else float(token_caps[index]),
+                'max_poll_interval': windows[(alert, level)],
+            })
+        # Alerts only reachable at the coarser interval (e.g. a later buy zone re-basing the multiples)
+        raw_keys = {(alert, level) for alert, _, level in raw_events}
+        for alert, index, level in polled_events:
+            if (alert, level) not in raw_keys:
+                alerts.append({
+                    'token_id': token_id,
+                    'token_name': rules['token_name'],
+                    'alert': 'buy_zone' if alert == 'buy_zone' else f"{level:g}x",
+                    'first_possible_at': None,
+                    'fired_at': float(poll_times[index]),
+                    'market_cap': float(poll_caps[index]),
+                    'max_poll_interval': None,
+                })
+    return alerts
+
+# ----- REPORTING -----
+def _format_time(epoch_seconds):
+    if epoch_seconds is None:
+        return ''
+    return datetime.fromtimestamp(epoch_seconds, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def write_alerts_csv(alerts, out):
+    writer = csv.writer(out)
+    writer.writerow(['token_id', 'token_name', 'alert', 'first_possible_at', 'fired_at', 'market_cap',
+                     'max_poll_interval_minutes'])
+    for alert in sorted(alerts, key=lambda a: (a['fired_at'] or a['first_possible_at'], a['token_id'])):
+        window = alert['max_poll_interval']
+        writer.writerow([
+            alert['token_id'], alert['token_name'], alert['alert'],
+            _format_time(alert['first_possible_at']), _format_time(alert['fired_at']),
+            f"{alert['market_cap']:.2f}", '' if window is None else f"{window / 60:.1f}",
+        ])
+
+def summarize(alerts, interval):
+    fired = [a for a in alerts if a['fired_at'] is not None]
+    missed = [a for a in alerts if a['fired_at'] is None]
+    buy_zone = sum(1 for a in fired if a['alert'] == 'buy_zone')
+    windows = np.array([a['max_poll_interval'] for a in alerts if a['max_poll_interval'] is not None])
+
+    lines = [
+        f"Poll interval: {f'{interval / 60:g} minutes' if interval else 'every recorded quote'}",
+        f"Messages sent: {len(fired)} ({buy_zone} buy zone, {len(fired) - buy_zone} multiples)",
+        f"Alerts missed compared to every recorded quote: {len(missed)}",
+    ]
+    if len(windows):
+        lines.append(
+            "Poll interval needed to catch all / 90% / 50% of time-limited alerts: "
+            f"{windows.min() / 60:.1f} / {np.percentile(windows, 10) / 60:.1f} / {np.percentile(windows, 50) / 60:.1f} minutes"
+        )
+    return "\n".join(lines)
+
+# ----- CLI -----
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Replay recorded market caps through the MavBot alert rules.")
+    parser.add_argument('--interval', type=float, default=30,
+                        help="Poll interval in minutes to simulate; 0 polls every recorded quote (default 30)")
+    parser.add_argument('--multiples', help="Comma-separated multiples to announce (default: the live list)")
+    parser.add_argument('--initial', choices=['first', 'db'], default='first',
+                        help="Initial market cap: first recorded quote or the stored initial_market_cap")
+    parser.add_argument('--since', help="Only replay history recorded from this UTC date/time")
+    parser.add_argument('--until', help="Only replay history recorded before this UTC date/time")
+    parser.add_argument('--out', help="Write every alert to this CSV file (default: stdout)")
+    args = parser.parse_args()
+
+    multiples = alert_rules.MULTIPLES_TO_CHECK
+    if args.multiples:
+        multiples = [float(m) for m in args.multiples.split(',')]
+    interval = args.interval * 60 or None
+
+    tokens = load_tokens()
+    token_ids, times, market_caps = load_history(args.since, args.until)
+    logger.info(f"Replaying {len(times)} quotes for {len(np.unique(token_ids))} tokens")
+    alerts = run_backtest(tokens, token_ids, times, market_caps, interval, multiples, args.initial)
+
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8') as out:
+            write_alerts_csv(alerts, out)
+    else:
+        write_alerts_csv(alerts, sys.stdout)
+    print(summarize(alerts, interval), file=sys.stderr if not args.out else sys.stdout)
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,17 @@ import logging
 from telegram import ReplyKeyboardMarkup, Update, ParseMode
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackContext
 from telegram.error import RetryAfter, NetworkError
+from telegram.utils.helpers import escape_markdown
 import mysql.connector
 from dotenv import load_dotenv
 import requests
 import time
+import tempfile
+import csv
+import watchlist_io
+import token_queries
+import charts
+import profiling
 
 # Load environment variables from .env file
 load_dotenv()
@@ -43,7 +50,8 @@ DEXSCREENER_API_URL = "https://api.dexscreener.com/latest/dex/tokens/"
     EDIT_FIELD,
     UPDATE_FIELD,
     EDIT_CONFIRMATION,
-) = range(15)
+    IMPORT_FILE,
+) = range(16)
 
 def check_user(update: Update) -> bool:
     return update.effective_user.id == ALLOWED_USER_ID
@@ -198,7 +206,7 @@ def store_in_db(data: dict):
              buy_tax, sell_tax, transfer_tax, try_buy_at_min, try_buy_at_max, chain, initial_market_cap, timestamp)
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
         """
-        market_cap = get_market_cap_from_dexscreener(data['contract_address'])
+        market_cap = get_market_cap_from_dexscreener(data['contract_address'], data['chain'])
         cursor.execute(insert_query, (
             data['contract_address'],
             data['token_name'],
@@ -223,9 +231,15 @@ def store_in_db(data: dict):
             conn.close()
 
 # ----- FETCH MARKET CAP FUNCTION -----
-def get_market_cap_from_dexscreener(contract_address):
+def get_market_cap_from_dexscreener(contract_address, chain=None):
+    # Callers asking for the same contract at the same time share one request
+    return watchlist_io.market_cap_flight.do(
+        watchlist_io.market_cap_key(chain, contract_address), fetch_market_cap, contract_address
+    )
+
+def fetch_market_cap(contract_address):
     try:
-        response = requests.get(f"{DEXSCREENER_API_URL}{contract_address}")
+        response = requests.get(f"{DEXSCREENER_API_URL}{contract_address}", timeout=30)
         if response.status_code != 200:
             logger.error(f"Failed to fetch data from DexScreener for {contract_address}: {response.status_code}")
             return None
@@ -244,85 +258,145 @@ def get_market_cap_from_dexscreener(contract_address):
         logger.error(f"Error fetching market cap: {e}")
         return None
 
-# /view function to list all tokens with their market cap and try-buy-at
+# /view function to list one page of tokens with their market cap and try-buy-at
+@profiling.profiled
 def view_tokens(update, context):
-    logger.info("Fetching all tokens for /view")
-    conn = None
-    cursor = None
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
+        filters = token_queries.parse_filters(context.args)
+    except ValueError as err:
+        update.message.reply_text(f"{err}\n{token_queries.FILTER_HELP}")
+        return
+
+    logger.info(f"Fetching tokens for /view: {token_queries.format_filters(filters)}")
+    try:
+        tokens, has_more = token_queries.fetch_token_page(
+            ['token_name', 'contract_address', 'chain', 'try_buy_at_min', 'try_buy_at_max'], filters
         )
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT token_name, contract_address, try_buy_at_min, try_buy_at_max FROM token_details")
-        tokens = cursor.fetchall()
-
-        if not tokens:
-            update.message.reply_text("No tokens found.")
-            return
-
-        message_lines = []
-        for token in tokens:
-            market_cap = get_market_cap_from_dexscreener(token['contract_address'])
-            if market_cap is not None:
-                message_lines.append(
-                    f"{token['token_name']}: Current MC: ${market_cap:,.2f}, Try Buy At Range: ${token['try_buy_at_min']:,.2f} - ${token['try_buy_at_max']:,.2f}"
-                )
-            else:
-                message_lines.append(f"{token['token_name']}: Could not fetch market cap")
+    except mysql.connector.Error as err:
+        logger.error(f"Error: {err}")
+        update.message.reply_text("An error occurred while fetching tokens.")
+        return
 
-        update.message.reply_text("\n".join(message_lines))
+    if not tokens:
+        update.message.reply_text("No tokens found.")
+        return
+
+    # Only the tokens on this page are quoted, in a single batched request
+    market_caps = watchlist_io.fetch_market_caps([(token['chain'], token['contract_address']) for token in tokens])
+
+    message_lines = []
+    for token in tokens:
+        market_cap = market_caps.get(watchlist_io.market_cap_key(token['chain'], token['contract_address']))
+        if market_cap is not None:
+            message_lines.append(
+                f"{token['token_name']}: Current MC: ${market_cap:,.2f}, Try Buy At Range: ${token['try_buy_at_min']:,.2f} - ${token['try_buy_at_max']:,.2f}"
+            )
+        else:
+            message_lines.append(f"{token['token_name']}: Could not fetch market cap")
+
+    if has_more:
+        next_filters = token_queries.next_page_filters(filters, tokens)
+        message_lines.append(f"\nPage {filters['page']}. Next: /view {token_queries.format_filters(next_filters)}")
+
+    update.message.reply_text("\n".join(message_lines))
+
+# /chart function to send market cap sparklines for one page of tokens
+@profiling.profiled
+def chart_tokens(update, context):
+    try:
+        filters = token_queries.parse_filters(context.args)
+    except ValueError as err:
+        update.message.reply_text(f"{err}\n{token_queries.FILTER_HELP}")
+        return
+
+    try:
+        tokens, has_more = token_queries.fetch_token_page(['token_name', 'contract_address', 'chain'], filters)
+        history = charts.fetch_market_cap_history([token['id'] for token in tokens])
     except mysql.connector.Error as err:
         logger.error(f"Error: {err}")
         update.message.reply_text("An error occurred while fetching tokens.")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        return
+
+    if not tokens:
+        update.message.reply_text("No tokens found.")
+        return
+
+    market_caps = watchlist_io.fetch_market_caps([(token['chain'], token['contract_address']) for token in tokens])
+    missing = []
+    for token in tokens:
+        market_cap = market_caps.get(watchlist_io.market_cap_key(token['chain'], token['contract_address']))
+        caption = f"{token['token_name']}: Current MC: ${market_cap:,.2f}" if market_cap is not None else token['token_name']
+        if not charts.send_chart(
+            context.bot, update.effective_chat.id, token['id'],
+            caption=caption, history=history[token['id']]
+        ):
+            missing.append(token['token_name'])
+
+    message_lines = []
+    if missing:
+        message_lines.append(f"No market cap history yet for: {', '.join(missing)}")
+    if has_more:
+        next_filters = token_queries.next_page_filters(filters, tokens)
+        message_lines.append(f"Page {filters['page']}. Next: /chart {token_queries.format_filters(next_filters)}")
+    if message_lines:
+        update.message.reply_text("\n".join(message_lines))
 
 # ----- EDIT FUNCTION -----
-def edit(update: Update, context: CallbackContext) -> int:
-    if not check_user(update):
-        update.message.reply_text("🚫 You are not authorized to use this bot.")
-        return ConversationHandler.END
+PREVIOUS_PAGE_BUTTON = "⬅️ Previous page"
+NEXT_PAGE_BUTTON = "➡️ Next page"
 
+def send_edit_token_page(update: Update, context: CallbackContext) -> int:
+    filters = context.user_data['edit_filters']
     try:
-        conn = mysql.connector.connect(
-            host=os.getenv('DB_HOST'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
-        )
-        cursor = conn.cursor()
-        cursor.execute("SELECT token_name, id FROM token_details")
-        tokens = cursor.fetchall()
+        tokens, has_more = token_queries.fetch_token_page(['token_name'], filters)
     except mysql.connector.Error as err:
         logger.error(f"Error: {err}")
         update.message.reply_text("An error occurred while fetching tokens.")
         return ConversationHandler.END
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
     if not tokens:
         update.message.reply_text("No tokens found to edit.")
         return ConversationHandler.END
 
-    token_keyboard = [[token[0]] for token in tokens]
-    context.user_data['token_id_map'] = {token[0]: token[1] for token in tokens}
+    token_keyboard = [[token['token_name']] for token in tokens]
+    navigation = []
+    if filters['page'] > 1:
+        navigation.append(PREVIOUS_PAGE_BUTTON)
+    if has_more:
+        navigation.append(NEXT_PAGE_BUTTON)
+    if navigation:
+        token_keyboard.append(navigation)
+    context.user_data['token_id_map'] = {token['token_name']: token['id'] for token in tokens}
 
     reply_markup = ReplyKeyboardMarkup(token_keyboard, one_time_keyboard=True)
-    update.message.reply_text("Select a token to edit:", reply_markup=reply_markup)
+    update.message.reply_text(f"Select a token to edit (page {filters['page']}):", reply_markup=reply_markup)
     return SELECT_TOKEN
 
+@profiling.profiled
+def edit(update: Update, context: CallbackContext) -> int:
+    if not check_user(update):
+        update.message.reply_text("🚫 You are not authorized to use this bot.")
+        return ConversationHandler.END
+
+    try:
+        filters = token_queries.parse_filters(context.args)
+    except ValueError as err:
+        update.message.reply_text(f"{err}\n{token_queries.FILTER_HELP}")
+        return ConversationHandler.END
+
+    # The keyboard pages with OFFSET so the previous page can be reached again
+    filters.pop('after', None)
+    context.user_data['edit_filters'] = filters
+    return send_edit_token_page(update, context)
+
 def select_token(update: Update, context: CallbackContext) -> int:
     token_name = update.message.text.strip()
+    if token_name in [PREVIOUS_PAGE_BUTTON, NEXT_PAGE_BUTTON]:
+        filters = context.user_data['edit_filters']
+        step = 1 if token_name == NEXT_PAGE_BUTTON else -1
+        context.user_data['edit_filters'] = dict(filters, page=max(filters['page'] + step, 1))
+        return send_edit_token_page(update, context)
+
     token_id_map = context.user_data.get('token_id_map', {})
     token_id = token_id_map.get(token_name)
 
@@ -437,6 +511,105 @@ def edit_confirmation(update: Update, context: CallbackContext) -> int:
         update.message.reply_text("Edit operation cancelled.")
     return ConversationHandler.END
 
+# ----- IMPORT / EXPORT FUNCTIONS -----
+def import_command(update: Update, context: CallbackContext) -> int:
+    if not check_user(update):
+        update.message.reply_text("🚫 You are not authorized to use this bot.")
+        return ConversationHandler.END
+    # Imported tokens are announced to the group in one summary unless asked otherwise
+    context.user_data['import_announce'] = bool(context.args) and context.args[0].lower() == 'announce'
+    update.message.reply_text(
+        "📥 Send a *CSV or JSON file* with the columns:\n"
+        f"`{', '.join(watchlist_io.IMPORT_FIELDS)}`",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    return IMPORT_FILE
+
+def format_import_summary(tokens):
+    chains = {}
+    for token in tokens:
+        chains[token['chain']] = chains.get(token['chain'], 0) + 1
+    chain_lines = [f"🌐 {escape_markdown(chain)}: {count}" for chain, count in sorted(chains.items(), key=lambda c: -c[1])]
+    return f"📥 *{len(tokens)} Tokens Added to Watchlist!*\n\n" + "\n".join(chain_lines)
+
+@profiling.profiled
+def import_file(update: Update, context: CallbackContext) -> int:
+    document = update.message.document
+    fmt = watchlist_io.detect_format(document.file_name or '')
+    update.message.reply_text("⏳ Importing tokens...")
+
+    with tempfile.NamedTemporaryFile(suffix=f".{fmt}") as tmp:
+        context.bot.get_file(document.file_id).download(custom_path=tmp.name)
+        try:
+            announce = context.user_data.get('import_announce', False)
+            inserted, skipped, errors = watchlist_io.import_tokens(tmp.name, fmt, announce)
+        except (ValueError, UnicodeDecodeError, csv.Error) as err:
+            logger.error(f"Error reading import file: {err}")
+            update.message.reply_text("❌ Could not read the file. Please send a valid CSV or JSON file.")
+            return ConversationHandler.END
+        except mysql.connector.Error as err:
+            logger.error(f"Error: {err}")
+            update.message.reply_text("An error occurred while importing tokens.")
+            return ConversationHandler.END
+
+    if inserted and not announce:
+        send_message_with_retry(context.bot, GROUP_CHAT_ID, format_import_summary(inserted))
+
+    message_lines = [f"✅ Imported {len(inserted)} tokens, skipped {skipped} already in the watchlist, {len(errors)} invalid rows."]
+    message_lines.extend(errors[:10])
+    if len(errors) > 10:
+        message_lines.append(f"... and {len(errors) - 10} more invalid rows")
+    update.message.reply_text("\n".join(message_lines))
+    return ConversationHandler.END
+
+@profiling.profiled
+def export_command(update: Update, context: CallbackContext):
+    if not check_user(update):
+        update.message.reply_text("🚫 You are not authorized to use this bot.")
+        return
+    fmt = 'json' if context.args and context.args[0].lower() == 'json' else 'csv'
+
+    try:
+        with tempfile.NamedTemporaryFile('w+', suffix=f".{fmt}", newline='', encoding='utf-8') as tmp:
+            count = watchlist_io.export_tokens(tmp, fmt)
+            tmp.flush()
+            with open(tmp.name, 'rb') as document:
+                update.message.reply_document(
+                    document=document,
+                    filename=f"watchlist.{fmt}",
+                    caption=f"📤 Exported {count} tokens."
+                )
+    except mysql.connector.Error as err:
+        logger.error(f"Error: {err}")
+        update.message.reply_text("An error occurred while exporting tokens.")
+
+# ----- PROFILE FUNCTION -----
+def profile_command(update: Update, context: CallbackContext):
+    if not check_user(update):
+        update.message.reply_text("🚫 You are not authorized to use this bot.")
+        return
+
+    args = context.args or []
+    try:
+        target = args[0]
+        runs = int(args[1]) if len(args) > 1 else 1
+        if target not in profiling.PROFILED_TARGETS or runs < 1:
+            raise ValueError(target)
+    except (IndexError, ValueError):
+        update.message.reply_text(
+            "Usage: /profile <job or handler> [runs] [nosend]\n"
+            "e.g. /profile check_market_caps_for_all_tokens 3\n"
+            f"Targets: {', '.join(profiling.PROFILED_TARGETS)}"
+        )
+        return
+
+    send_results = 'nosend' not in [arg.lower() for arg in args[2:]]
+    profiling.request_profile(target, runs, update.effective_chat.id if send_results else None)
+    update.message.reply_text(
+        f"🩺 Profiling the next {runs} runs of {target}. Results are written to {profiling.PROFILE_DIR}/"
+        + (" and sent here." if send_results else ".")
+    )
+
 # ----- MAIN FUNCTION -----
 def main():
     TOKEN = os.getenv('BOT_API_TOKEN')
@@ -444,8 +617,20 @@ def main():
     updater = Updater(TOKEN, use_context=True)
     dp = updater.dispatcher
 
+    def send_profile_report(chat_id, path):
+        with open(path, 'rb') as document:
+            updater.bot.send_document(chat_id=chat_id, document=document, filename=os.path.basename(path))
+    profiling.set_report_sender(send_profile_report)
+
+    # Deliver profiles of bot1.py jobs, which bot1 queues in PROFILE_DIR
+    updater.job_queue.run_repeating(lambda context: profiling.deliver_queued_reports(), interval=30, first=30)
+
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start), CommandHandler('edit', edit)],
+        entry_points=[
+            CommandHandler('start', start),
+            CommandHandler('edit', edit),
+            CommandHandler('import', import_command),
+        ],
         states={
             TOKEN_NAME: [MessageHandler(Filters.text & ~Filters.command, token_name)],
             CONTRACT_ADDRESS: [MessageHandler(Filters.text & ~Filters.command, contract_address)],
@@ -462,12 +647,16 @@ def main():
             EDIT_FIELD: [MessageHandler(Filters.text & ~Filters.command, edit_field)],
             UPDATE_FIELD: [MessageHandler(Filters.text & ~Filters.command, update_field)],
             EDIT_CONFIRMATION: [MessageHandler(Filters.text & ~Filters.command, edit_confirmation)],
+            IMPORT_FILE: [MessageHandler(Filters.document, import_file)],
         },
         fallbacks=[CommandHandler('cancel', cancel)]
     )
 
     dp.add_handler(conv_handler)
     dp.add_handler(CommandHandler('view', view_tokens))
+    dp.add_handler(CommandHandler('chart', chart_tokens))
+    dp.add_handler(CommandHandler('export', export_command))
+    dp.add_handler(CommandHandler('profile', profile_command))
 
     updater.start_polling()
     updater.idle()
@@ -1,13 +1,21 @@
 import os
+import sys
+import json
 import logging
+import signal
+import threading
 import time
 from telegram import ParseMode, Bot
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
 import mysql.connector
 import requests
+import charts
+import alert_rules
+import watchlist_io
+import profiling
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,11 +38,30 @@ DEXSCREENER_API_URL = "https://api.dexscreener.com/latest/dex/tokens/"
 second_bot_token = os.getenv('SECOND_BOT_API_TOKEN')
 second_bot = Bot(token=second_bot_token)
 
-# Fetch market cap from DexScreener
-def get_market_cap_from_dexscreener(contract_address):
+# Scanner snapshot used to warm start after a restart or deploy
+SNAPSHOT_PATH = os.getenv('SCANNER_SNAPSHOT_PATH', 'scanner_snapshot.json')
+SNAPSHOT_INTERVAL_MINUTES = int(os.getenv('SCANNER_SNAPSHOT_INTERVAL_MINUTES', '5'))
+
+# Reuse a recent quote instead of fetching the same contract again. Quotes older than
+# this are pruned from the snapshot, so after a quick restart the first sweep only
+# fetches contracts that were not quoted just before shutdown.
+QUOTE_MAX_AGE_SECONDS = 300
+
+# Scanner state shared between scheduler jobs and persisted in the snapshot
+state_lock = threading.Lock()
+last_quotes = {}      # contract_address -> {'market_cap': float, 'fetched_at': epoch seconds}
+pending_alerts = {}   # 'token_id:kind' -> alert sent to Telegram but not yet recorded in the database
+
+# Fetch market cap from DexScreener, sharing the request with concurrent callers for the same contract
+def get_market_cap_from_dexscreener(contract_address, chain=None):
+    return watchlist_io.market_cap_flight.do(
+        watchlist_io.market_cap_key(chain, contract_address), fetch_market_cap, contract_address
+    )
+
+def fetch_market_cap(contract_address):
     try:
         logger.info(f"Fetching market cap for contract: {contract_address}")
-        response = requests.get(f"{DEXSCREENER_API_URL}{contract_address}")
+        response = requests.get(f"{DEXSCREENER_API_URL}{contract_address}", timeout=30)
         
         if response.status_code != 200:
             logger.error(f"Failed to fetch data from DexScreener for {contract_address}: {response.status_code}")
@@ -51,6 +78,8 @@ def get_market_cap_from_dexscreener(contract_address):
             if 'marketCap' in pair:
                 market_cap = float(pair['marketCap'])
                 logger.info(f"Market cap for {contract_address}: {market_cap}")
+                with state_lock:
+                    last_quotes[contract_address] = {'market_cap': market_cap, 'fetched_at': time.time()}
                 return market_cap
         
         logger.warning(f"Market cap data not available for {contract_address} on DexScreener.")
@@ -59,10 +88,20 @@ def get_market_cap_from_dexscreener(contract_address):
         logger.error(f"Error fetching market cap from DexScreener: {e}")
         return None
 
+# Return the last quote for a contract if it is recent enough
+def get_recent_market_cap(contract_address, max_age=QUOTE_MAX_AGE_SECONDS):
+    with state_lock:
+        quote = last_quotes.get(contract_address)
+    if quote and time.time() - quote['fetched_at'] <= max_age:
+        return quote['market_cap']
+    return None
+
 # Send new token notification
 def send_new_token_message(token):
     try:
-        market_cap = get_market_cap_from_dexscreener(token['contract_address'])
+        market_cap = get_recent_market_cap(token['contract_address'])
+        if market_cap is None:
+            market_cap = get_market_cap_from_dexscreener(token['contract_address'], token['chain'])
 
         market_cap_text = f"${market_cap:,.2f}" if market_cap else "N/A"
 
@@ -91,6 +130,7 @@ def send_new_token_message(token):
         logger.error(f"Failed to send new token message: {e}")
 
 # Check for new tokens added to the database every 1 minute
+@profiling.profiled
 def check_for_new_tokens():
     logger.info("Checking for newly added tokens...")
     conn = None
@@ -149,6 +189,7 @@ def update_token_notified_at(token_id):
             conn.close()
 
 # Check all tokens for market cap to track buy zone or gains
+@profiling.profiled
 def check_market_caps_for_all_tokens():
     logger.info("Checking market caps for all tokens...")
     conn = None
@@ -163,6 +204,8 @@ def check_market_caps_for_all_tokens():
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT * FROM token_details")
         tokens = cursor.fetchall()
+        history_rows = []
+        scan_market_caps = {}  # Duplicate contract rows are fetched once per scan: key -> (market cap, fetched now)
 
         for token in tokens:
             contract_address = token['contract_address']
@@ -173,34 +216,54 @@ def check_market_caps_for_all_tokens():
             last_notified_multiple = token['last_notified_multiple'] or 1
 
             # Fetch current market cap
-            market_cap = get_market_cap_from_dexscreener(contract_address)
+            key = watchlist_io.market_cap_key(token['chain'], contract_address)
+            if key in scan_market_caps:
+                market_cap, fetched_now = scan_market_caps[key]
+            else:
+                market_cap = get_recent_market_cap(contract_address)
+                fetched_now = market_cap is None
+                if fetched_now:
+                    market_cap = get_market_cap_from_dexscreener(contract_address, token['chain'])
+                    time.sleep(1)  # Sleep to avoid rate limits
+                scan_market_caps[key] = (market_cap, fetched_now)
             if market_cap is None:
                 logger.warning(f"Could not fetch market cap for {token_name}")
                 continue
+            # Reused quotes are older than this sweep; only fresh quotes go into the history
+            if fetched_now:
+                history_rows.append((token['id'], market_cap, datetime.utcnow()))
 
             # Convert initial_market_cap to float if it's Decimal
             if isinstance(initial_market_cap, Decimal):
                 initial_market_cap = float(initial_market_cap)
 
+            # Alerts sent earlier whose database write failed count as notified
+            buy_zone_notified = token['buy_zone_notified_at'] is not None
+            if retry_pending_alert(token['id'], 'buy_zone'):
+                buy_zone_notified = True
+            pending_multiple = retry_pending_alert(token['id'], 'multiple')
+            if pending_multiple:
+                last_notified_multiple = max(last_notified_multiple, pending_multiple['multiple'])
+
             # Check if market cap is within buy zone range and not notified yet
-            if market_cap >= try_buy_at_min and market_cap <= try_buy_at_max and token['buy_zone_notified_at'] is None:
+            if alert_rules.in_buy_zone(market_cap, try_buy_at_min, try_buy_at_max) and not buy_zone_notified:
                 logger.info(f"Token {token_name} entered buy zone: {try_buy_at_min} <= {market_cap} <= {try_buy_at_max}")
                 send_token_in_buy_zone_message(token, market_cap)
-                update_token_after_buy_initiated(token['id'], market_cap)
+                set_pending_alert(token['id'], {'kind': 'buy_zone', 'market_cap': market_cap})
+                if update_token_after_buy_initiated(token['id'], market_cap):
+                    clear_pending_alert(token['id'], 'buy_zone')
             else:
                 logger.info(f"Token {token_name} not in buy zone or already notified - Market Cap: {market_cap}, Range: {try_buy_at_min}-{try_buy_at_max}")
-            
-            # Check for market cap multiples (gains)
-            if initial_market_cap > 0:
-                multiple = market_cap / initial_market_cap
-                multiples_to_check = [5, 7, 10, 15, 20, 25, 50, 100, 200, 250, 300, 400, 500]
-                for m in multiples_to_check:
-                    if multiple >= m and last_notified_multiple < m:
-                        send_multiple_achieved_message(token, market_cap, m)
-                        update_last_notified_multiple(token['id'], m)
-                        break
 
-            time.sleep(1)  # Sleep to avoid rate limits
+            # Check for market cap multiples (gains)
+            m = alert_rules.multiple_to_notify(market_cap, initial_market_cap, last_notified_multiple)
+            if m is not None:
+                send_multiple_achieved_message(token, market_cap, m)
+                set_pending_alert(token['id'], {'kind': 'multiple', 'multiple': m})
+                if update_last_notified_multiple(token['id'], m):
+                    clear_pending_alert(token['id'], 'multiple')
+
+        record_market_cap_history(conn, history_rows)
     except mysql.connector.Error as err:
         logger.error(f"Error: {err}")
     finally:
@@ -209,6 +272,41 @@ def check_market_caps_for_all_tokens():
         if conn is not None:
             conn.close()
 
+# Store the market caps fetched in a sweep for charts and backtests
+def record_market_cap_history(conn, history_rows):
+    if not history_rows:
+        return
+    cursor = conn.cursor()
+    try:
+        insert_query = (
+            "INSERT INTO market_cap_history (token_id, market_cap, recorded_at) VALUES "
+            + ", ".join(["(%s, %s, %s)"] * len(history_rows))
+        )
+        cursor.execute(insert_query, [value for row in history_rows for value in row])
+        conn.commit()
+        logger.info(f"Recorded {len(history_rows)} market caps.")
+    finally:
+        cursor.close()
+
+# Send an alert with the token's market cap sparkline, falling back to text only
+def send_alert_message(token, message, market_cap):
+    try:
+        if charts.send_chart(
+            second_bot, GROUP_CHAT_ID, token['id'],
+            caption=message, parse_mode=ParseMode.MARKDOWN, latest=market_cap
+        ):
+            return
+    except Exception as e:
+        # The alert itself must never depend on the chart
+        logger.error(f"Failed to send chart for {token['token_name']}, sending text only: {e}")
+
+    second_bot.send_message(
+        chat_id=GROUP_CHAT_ID,
+        text=message,
+        parse_mode=ParseMode.MARKDOWN,
+        disable_web_page_preview=True
+    )
+
 # Send message when token enters buy zone
 def send_token_in_buy_zone_message(token, market_cap):
     try:
@@ -221,12 +319,7 @@ def send_token_in_buy_zone_message(token, market_cap):
             f"💰 *Current Market Cap:* {market_cap_text}\n"
             f"⏰ *Time:* {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')} UTC\n"
         )
-        second_bot.send_message(
-            chat_id=GROUP_CHAT_ID,
-            text=message,
-            parse_mode=ParseMode.MARKDOWN,
-            disable_web_page_preview=True
-        )
+        send_alert_message(token, message, market_cap)
         logger.info(f"Buy zone message sent for {token['token_name']}.")
     except Exception as e:
         logger.error(f"Failed to send buy zone message: {e}")
@@ -243,12 +336,7 @@ def send_multiple_achieved_message(token, market_cap, multiple):
             f"💰 *Current Market Cap:* ${market_cap:,.2f}\n"
             f"📈 *Gain:* {multiple}x\n"
         )
-        second_bot.send_message(
-            chat_id=GROUP_CHAT_ID,
-            text=message,
-            parse_mode=ParseMode.MARKDOWN,
-            disable_web_page_preview=True
-        )
+        send_alert_message(token, message, market_cap)
         logger.info(f"{multiple}x achieved message sent for {token['token_name']}.")
     except Exception as e:
         logger.error(f"Failed to send multiple achieved message: {e}")
@@ -273,8 +361,10 @@ def update_token_after_buy_initiated(token_id, market_cap):
         cursor.execute(update_query, (datetime.utcnow(), market_cap, datetime.utcnow(), token_id))
         conn.commit()
         logger.info(f"Token {token_id} updated after entering buy zone.")
+        return True
     except mysql.connector.Error as err:
         logger.error(f"Error updating token after buy zone: {err}")
+        return False
     finally:
         if cursor is not None:
             cursor.close()
@@ -301,23 +391,142 @@ def update_last_notified_multiple(token_id, multiple):
         cursor.execute(update_query, (multiple, token_id))
         conn.commit()
         logger.info(f"Token {token_id} last notified multiple updated to {multiple}.")
+        return True
     except mysql.connector.Error as err:
         logger.error(f"Error updating last notified multiple: {err}")
+        return False
     finally:
         if cursor is not None:
             cursor.close()
         if conn is not None:
             conn.close()
 
+# Track alerts that were sent but whose database update has not landed yet
+def set_pending_alert(token_id, alert):
+    with state_lock:
+        pending_alerts[f"{token_id}:{alert['kind']}"] = alert
+
+def clear_pending_alert(token_id, kind):
+    with state_lock:
+        pending_alerts.pop(f"{token_id}:{kind}", None)
+
+# Retry the database write for an alert that was already sent. Returns the pending
+# alert (whether or not the retry succeeded) so the caller does not send it again.
+def retry_pending_alert(token_id, kind):
+    with state_lock:
+        alert = pending_alerts.get(f"{token_id}:{kind}")
+    if alert is None:
+        return None
+
+    if kind == 'buy_zone':
+        recorded = update_token_after_buy_initiated(token_id, alert['market_cap'])
+    else:
+        recorded = update_last_notified_multiple(token_id, alert['multiple'])
+    if recorded:
+        clear_pending_alert(token_id, kind)
+    return alert
+
+# Record alerts that were sent before the last shutdown without being written to the database
+def replay_pending_alerts():
+    with state_lock:
+        pending_keys = list(pending_alerts)
+
+    for pending_key in pending_keys:
+        token_id, kind = pending_key.split(':')
+        retry_pending_alert(int(token_id), kind)
+
+# Load the scanner snapshot written by a previous run
+def load_scanner_snapshot():
+    try:
+        with open(SNAPSHOT_PATH, encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        logger.info("No scanner snapshot found, starting cold.")
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read scanner snapshot: {e}")
+        return {}
+
+    with state_lock:
+        last_quotes.update(snapshot.get('last_quotes', {}))
+        pending_alerts.update(snapshot.get('pending_alerts', {}))
+    logger.info(f"Loaded scanner snapshot from {snapshot.get('saved_at')} with {len(last_quotes)} quotes.")
+    return snapshot
+
+# Persist quotes, next run times and pending alerts so a restart can resume immediately
+def get_next_run_times(scheduler):
+    return {
+        job.id: job.next_run_time.isoformat()
+        for job in scheduler.get_jobs()
+        if job.next_run_time is not None
+    }
+
+def save_scanner_snapshot(scheduler, next_run_times=None):
+    if next_run_times is None:
+        next_run_times = get_next_run_times(scheduler)
+    with state_lock:
+        # Drop quotes too old to be reused so the dict stays bounded
+        cutoff = time.time() - QUOTE_MAX_AGE_SECONDS
+        for contract_address in [c for c, quote in last_quotes.items() if quote['fetched_at'] < cutoff]:
+            del last_quotes[contract_address]
+        snapshot = {
+            'saved_at': datetime.now(timezone.utc).isoformat(),
+            'last_quotes': dict(last_quotes),
+            'next_run_times': next_run_times,
+            'pending_alerts': dict(pending_alerts),
+        }
+
+    tmp_path = f"{SNAPSHOT_PATH}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_path, SNAPSHOT_PATH)
+        logger.info("Scanner snapshot saved.")
+    except OSError as e:
+        logger.error(f"Could not save scanner snapshot: {e}")
+
+# Resume a job at its saved due time, or right away if it is overdue or unknown
+def next_run_time_from_snapshot(snapshot, job_id):
+    now = datetime.now(timezone.utc)
+    saved = snapshot.get('next_run_times', {}).get(job_id)
+    if saved:
+        try:
+            return max(datetime.fromisoformat(saved), now)
+        except ValueError:
+            logger.warning(f"Ignoring invalid next run time for {job_id}: {saved}")
+    return now
+
 # Main function to run the bot with different schedules
 def main():
+    snapshot = load_scanner_snapshot()
+
+    # Record alerts from the previous run before the first sweep can send them again
+    if pending_alerts:
+        replay_pending_alerts()
+
     scheduler = BackgroundScheduler(timezone='UTC')
-    
-    # Schedule to check for new tokens every 1 minute
-    scheduler.add_job(check_for_new_tokens, 'interval', minutes=2)
 
-    # Schedule to check all tokens for buy conditions and gains every 1 minute
-    scheduler.add_job(check_market_caps_for_all_tokens, 'interval', minutes=30)
+    # Schedule to check for new tokens every 2 minutes
+    scheduler.add_job(
+        check_for_new_tokens, 'interval', minutes=2, id='check_for_new_tokens',
+        next_run_time=next_run_time_from_snapshot(snapshot, 'check_for_new_tokens')
+    )
+
+    # Schedule to check all tokens for buy conditions and gains every 30 minutes
+    scheduler.add_job(
+        check_market_caps_for_all_tokens, 'interval', minutes=30, id='check_market_caps_for_all_tokens',
+        next_run_time=next_run_time_from_snapshot(snapshot, 'check_market_caps_for_all_tokens')
+    )
+
+    # Persist the scanner state periodically
+    scheduler.add_job(
+        save_scanner_snapshot, 'interval', minutes=SNAPSHOT_INTERVAL_MINUTES, args=[scheduler],
+        id='save_scanner_snapshot'
+    )
+
+    # Deploys and service managers stop the process with SIGTERM; exit through the
+    # same path as Ctrl+C so the snapshot is saved
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     scheduler.start()
     logger.info("Scheduler started.")
@@ -326,7 +535,10 @@ def main():
         while True:
             time.sleep(1)  # Sleep to prevent high CPU usage
     except (KeyboardInterrupt, SystemExit):
+        # A stopped scheduler no longer reports its jobs, so read the due times first
+        next_run_times = get_next_run_times(scheduler)
         scheduler.shutdown()
+        save_scanner_snapshot(scheduler, next_run_times)
         logger.info("Scheduler stopped.")
 
 if __name__ == '__main__':
@@ -0,0 +1,190 @@
+import os
+import io
+import time
+import zlib
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from telegram.error import BadRequest
+from watchlist_io import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Sparkline size and the history window it covers
+CHART_WIDTH = 320
+CHART_HEIGHT = 80
+CHART_PADDING = 4
+CHART_HISTORY_HOURS = int(os.getenv('CHART_HISTORY_HOURS', '24'))
+
+# Charts are cached per token and time bucket; market caps are recorded once per sweep
+CHART_BUCKET_SECONDS = int(os.getenv('CHART_BUCKET_SECONDS', '1800'))
+CHART_CACHE_MAX_BYTES = int(os.getenv('CHART_CACHE_MAX_BYTES', str(2 * 1024 * 1024)))
+FILE_ID_CACHE_MAX_ENTRIES = 1000
+
+BACKGROUND = (255, 255, 255)
+UP_LINE, UP_FILL = (22, 163, 74), (220, 252, 231)
+DOWN_LINE, DOWN_FILL = (220, 38, 38), (254, 226, 226)
+
+cache_lock = threading.Lock()
+_png_cache = OrderedDict()   # (token_id, bucket, latest) -> PNG bytes, least recently used first
+_png_cache_bytes = 0
+_file_ids = OrderedDict()    # (bot id, token_id, bucket, latest) -> Telegram file_id
+
+# ----- RASTERIZER -----
+def encode_png(width, height, pixels):
+    """Encode a packed RGB bytearray as a PNG image."""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    stride = width * 3
+    raw = b''.join(b'\x00' + bytes(pixels[y * stride:(y + 1) * stride]) for y in range(height))
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw, 9))
+        + chunk(b'IEND', b'')
+    )
+
+def render_sparkline(values, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """Draw a filled sparkline of `values` and return it as PNG bytes."""
+    pixels = bytearray(BACKGROUND * (width * height))
+
+    def fill_column(x, y_from, y_to, color):
+        for y in range(max(y_from, 0), min(y_to, height - 1) + 1):
+            offset = (y * width + x) * 3
+            pixels[offset:offset + 3] = bytes(color)
+
+    line, fill = (UP_LINE, UP_FILL) if values[-1] >= values[0] else (DOWN_LINE, DOWN_FILL)
+    low, high = min(values), max(values)
+    span = (high - low) or 1.0
+    plot_width = width - 2 * CHART_PADDING
+    plot_height = height - 2 * CHART_PADDING
+
+    def y_at(x):
+        # Linear interpolation between the two samples around column x
+        position = x * (len(values) - 1) / max(plot_width - 1, 1)
+        i = min(int(position), len(values) - 2) if len(values) > 1 else 0
+        value = values[i] if len(values) == 1 else values[i] + (values[i + 1] - values[i]) * (position - i)
+        return CHART_PADDING + int(round((high - value) / span * (plot_height - 1)))
+
+    previous_y = y_at(0)
+    for x in range(plot_width):
+        y = y_at(x)
+        column = x + CHART_PADDING
+        fill_column(column, y + 1, height - 1, fill)
+        # Join to the previous column and thicken the line by one pixel
+        fill_column(column, min(y, previous_y), max(y, previous_y) + 1, line)
+        previous_y = y
+
+    return encode_png(width, height, pixels)
+
+# ----- HISTORY -----
+def fetch_market_cap_history(token_ids, hours=CHART_HISTORY_HOURS):
+    """Return recorded market caps for the last `hours`, keyed by token id, oldest first."""
+    history = {token_id: [] for token_id in token_ids}
+    if not token_ids:
+        return history
+
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        placeholders = ', '.join(['%s'] * len(token_ids))
+        cursor.execute(
+            f"SELECT token_id, market_cap FROM market_cap_history "
+            f"WHERE token_id IN ({placeholders}) AND recorded_at >= UTC_TIMESTAMP() - INTERVAL %s HOUR "
+            f"ORDER BY token_id, recorded_at",
+            list(token_ids) + [hours]
+        )
+        for token_id, market_cap in cursor:
+            history[token_id].append(float(market_cap))
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+    return history
+
+# ----- CACHES -----
+def chart_key(token_id, latest=None, now=None):
+    # A chart drawn with an extra latest quote is a different image from the history-only one
+    return token_id, int((now or time.time()) // CHART_BUCKET_SECONDS), latest
+
+def _cache_png(key, png):
+    global _png_cache_bytes
+    with cache_lock:
+        if key in _png_cache:
+            return
+        _png_cache[key] = png
+        _png_cache_bytes += len(png)
+        while _png_cache_bytes > CHART_CACHE_MAX_BYTES and len(_png_cache) > 1:
+            _, evicted = _png_cache.popitem(last=False)
+            _png_cache_bytes -= len(evicted)
+
+def get_chart_png(token_id, history=None, latest=None):
+    """Return the cached or freshly rendered sparkline for a token, or None without history.
+
+    `latest` is appended to the recorded history so alerts include the quote that
+    triggered them; it is part of the cache key, so a history-only chart is never
+    reused for an alert.
+    """
+    key = chart_key(token_id, latest)
+    with cache_lock:
+        png = _png_cache.get(key)
+        if png is not None:
+            _png_cache.move_to_end(key)
+            return png
+
+    if history is None:
+        history = fetch_market_cap_history([token_id])[token_id]
+    values = list(history) + ([float(latest)] if latest is not None else [])
+    if len(values) < 2:
+        return None
+
+    png = render_sparkline(values)
+    _cache_png(key, png)
+    return png
+
+def _remember_file_id(key, file_id):
+    with cache_lock:
+        _file_ids[key] = file_id
+        _file_ids.move_to_end(key)
+        while len(_file_ids) > FILE_ID_CACHE_MAX_ENTRIES:
+            _file_ids.popitem(last=False)
+
+# ----- SENDING -----
+def send_chart(bot, chat_id, token_id, caption=None, parse_mode=None, history=None, latest=None):
+    """Send a token's sparkline as a photo. Returns False if there is no history to draw.
+
+    A chart already uploaded by this bot in the current bucket is re-sent by its
+    Telegram file_id instead of being rendered and uploaded again.
+    """
+    key = chart_key(token_id, latest)
+    file_id_key = (bot.id,) + key
+    with cache_lock:
+        file_id = _file_ids.get(file_id_key)
+
+    if file_id:
+        try:
+            bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption, parse_mode=parse_mode)
+            return True
+        except BadRequest as e:
+            logger.warning(f"Cached chart for token {token_id} was rejected, uploading again: {e}")
+            with cache_lock:
+                _file_ids.pop(file_id_key, None)
+
+    png = get_chart_png(token_id, history=history, latest=latest)
+    if png is None:
+        return False
+
+    message = bot.send_photo(
+        chat_id=chat_id,
+        photo=io.BytesIO(png),
+        caption=caption,
+        parse_mode=parse_mode
+    )
+    if message.photo:
+        _remember_file_id(file_id_key, message.photo[-1].file_id)
+    return True
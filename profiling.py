@@ -0,0 +1,180 @@
+import os
+import io
+import glob
+import json
+import time
+import pstats
+import logging
+import cProfile
+import functools
+import itertools
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+# Profiles and arm requests are shared between bot.py and bot1.py through this directory
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+TOP_ENTRIES = 25
+
+# Every job and handler wrapped with @profiled in bot.py and bot1.py
+PROFILED_TARGETS = [
+    'check_for_new_tokens', 'check_market_caps_for_all_tokens',
+    'view_tokens', 'chart_tokens', 'edit', 'import_file', 'export_command',
+]
+
+# target name -> {'runs': remaining runs, 'chat_id': chat to send results to or None}
+_armed = {}
+_armed_lock = threading.Lock()
+# cProfile cannot profile two calls at once, so only one profiled run happens at a time
+_profile_lock = threading.Lock()
+_report_sender = None
+_report_ids = itertools.count(1)
+
+def _arm_path(target):
+    return os.path.join(PROFILE_DIR, f"arm-{target}.json")
+
+def _load_env_targets():
+    # PROFILE_TARGETS=check_market_caps_for_all_tokens:3,view_tokens profiles the next N calls of each target
+    for entry in os.getenv('PROFILE_TARGETS', '').split(','):
+        if not entry.strip():
+            continue
+        target, _, runs = entry.strip().partition(':')
+        if target not in PROFILED_TARGETS:
+            logger.warning(f"Ignoring unknown profile target {target} in PROFILE_TARGETS")
+            continue
+        _armed[target] = {'runs': int(runs or 1), 'chat_id': None}
+
+_load_env_targets()
+
+def set_report_sender(sender):
+    """Register `sender(chat_id, path)` used to send result files back to Telegram.
+
+    Only bot.py registers a sender, since the requesting chat is a chat with its
+    bot. Other processes queue their reports in PROFILE_DIR for it to deliver.
+    """
+    global _report_sender
+    _report_sender = sender
+
+def _queue_report(chat_id, paths):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    outbox_path = os.path.join(PROFILE_DIR, f"outbox-{os.getpid()}-{next(_report_ids)}.json")
+    with open(outbox_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'chat_id': chat_id, 'paths': paths}, f)
+    os.replace(outbox_path + '.tmp', outbox_path)
+
+def deliver_queued_reports():
+    """Send reports queued by other processes through the registered sender."""
+    if _report_sender is None:
+        return
+    for outbox_path in sorted(glob.glob(os.path.join(PROFILE_DIR, 'outbox-*.json'))):
+        try:
+            with open(outbox_path, encoding='utf-8') as f:
+                report = json.load(f)
+            os.remove(outbox_path)
+            for path in report['paths']:
+                _report_sender(report['chat_id'], path)
+        except Exception as e:
+            logger.error(f"Failed to deliver profile report {outbox_path}: {e}")
+
+def request_profile(target, runs=1, chat_id=None):
+    """Arm the next `runs` calls of `target` in whichever process runs it."""
+    if target not in PROFILED_TARGETS:
+        raise ValueError(f"Unknown profile target {target}")
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = _arm_path(target) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'runs': runs, 'chat_id': chat_id}, f)
+    os.replace(tmp_path, _arm_path(target))
+
+def _claim(target):
+    """Return the arm request for a target, moving a pending request file into memory first."""
+    path = _arm_path(target)
+    with _armed_lock:
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    _armed[target] = json.load(f)
+                os.remove(path)
+                logger.info(f"Profiling armed for the next {_armed[target]['runs']} runs of {target}")
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not read profile request for {target}: {e}")
+        request = _armed.get(target)
+        if not request:
+            return None
+        request['runs'] -= 1
+        if request['runs'] <= 0:
+            del _armed[target]
+        return dict(request)
+
+def _write_report(target, profiler, allocations, peak):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{target}-{time.strftime('%Y%m%d-%H%M%S')}-{next(_report_ids)}")
+    profiler.dump_stats(f"{base}.pstats")
+
+    out = io.StringIO()
+    out.write(f"{target}: peak traced memory {peak / 1024:,.1f} KiB\n\n")
+    out.write(f"Top {TOP_ENTRIES} allocations:\n")
+    for stat in allocations[:TOP_ENTRIES]:
+        out.write(f"{stat}\n")
+    out.write("\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(TOP_ENTRIES)
+    with open(f"{base}.txt", 'w', encoding='utf-8') as f:
+        f.write(out.getvalue())
+    return [f"{base}.pstats", f"{base}.txt"]
+
+def _run_profiled(target, request, func, args, kwargs):
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            allocations = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]).statistics('lineno')
+            _, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        try:
+            paths = _write_report(target, profiler, allocations, peak)
+            logger.info(f"Profile for {target} written to {paths[0]}")
+            if request.get('chat_id'):
+                if _report_sender:
+                    for path in paths:
+                        _report_sender(request['chat_id'], path)
+                else:
+                    _queue_report(request['chat_id'], paths)
+        except Exception as e:
+            logger.error(f"Failed to write profile for {target}: {e}")
+
+def profiled(func):
+    """Profile a scheduler job or handler when it has been armed with /profile or PROFILE_TARGETS.
+
+    When nothing is armed the only cost is a dict lookup and one stat call.
+    """
+    target = func.__name__
+    if target not in PROFILED_TARGETS:
+        raise ValueError(f"{target} must be listed in PROFILED_TARGETS")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if target not in _armed and not os.path.exists(_arm_path(target)):
+            return func(*args, **kwargs)
+        if not _profile_lock.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            request = _claim(target)
+            if request is None:
+                return func(*args, **kwargs)
+            return _run_profiled(target, request, func, args, kwargs)
+        finally:
+            _profile_lock.release()
+
+    return wrapper
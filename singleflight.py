@@ -0,0 +1,83 @@
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Share one outstanding call per key between concurrent callers.
+
+    The first caller for a key runs the function; callers arriving while it is
+    in flight wait for and receive the same result (or exception). Nothing is
+    cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def _join(self, keys):
+        # Split keys into calls this thread must run and calls already in flight
+        owned, shared = {}, {}
+        with self._lock:
+            for key in keys:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    owned[key] = call
+                else:
+                    shared[key] = call
+        return owned, shared
+
+    def _finish(self, owned):
+        with self._lock:
+            for key in owned:
+                del self._calls[key]
+        for call in owned.values():
+            call.done.set()
+
+    @staticmethod
+    def _wait(call):
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` unless a call for `key` is already in flight."""
+        owned, shared = self._join([key])
+        if shared:
+            return self._wait(shared[key])
+
+        call = owned[key]
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._finish(owned)
+
+    def do_many(self, keys, fn):
+        """Resolve many keys at once, calling `fn(missing_keys) -> {key: result}` only
+        for keys that are not already in flight. Returns a dict for all keys."""
+        owned, shared = self._join(list(dict.fromkeys(keys)))
+        results = {}
+        if owned:
+            try:
+                fetched = fn(list(owned))
+                for key, call in owned.items():
+                    call.result = results[key] = fetched.get(key)
+            except BaseException as e:
+                for call in owned.values():
+                    call.error = e
+                raise
+            finally:
+                self._finish(owned)
+
+        for key, call in shared.items():
+            results[key] = self._wait(call)
+        return results
@@ -0,0 +1,151 @@
+import logging
+from watchlist_io import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 30  # One DexScreener batch request per page
+
+# Sort keys accepted by /view and /edit, mapped to indexed columns.
+# Prefix a key with '-' to sort descending (e.g. sort=-gain).
+SORT_COLUMNS = {
+    'added': 'id',
+    'name': 'token_name',
+    'chain': 'chain',
+    'gain': 'last_notified_multiple',
+}
+
+FILTER_HELP = (
+    "Filters: chain=<chain> zone=yes|no gain=<multiple> name=<prefix> "
+    "sort=added|name|chain|gain (prefix with - for descending) page=<n> size=<n> after=<id>"
+)
+
+def parse_filters(args):
+    """Parse `key=value` command arguments into a filters dict. Raises ValueError on bad input."""
+    filters = {'sort': 'added', 'descending': False, 'page': 1, 'size': DEFAULT_PAGE_SIZE}
+    for arg in args or []:
+        if '=' not in arg:
+            raise ValueError(f"Expected key=value, got '{arg}'")
+        key, value = arg.split('=', 1)
+        key = key.strip().lower()
+        value = value.strip()
+
+        if key == 'chain' or key == 'name':
+            filters[key] = value
+        elif key == 'zone':
+            if value.lower() not in ['yes', 'no']:
+                raise ValueError("zone must be 'yes' or 'no'")
+            filters['zone'] = value.lower() == 'yes'
+        elif key == 'gain':
+            filters['gain'] = float(value.rstrip('xX'))
+        elif key == 'sort':
+            filters['descending'] = value.startswith('-')
+            sort = value.lstrip('-').lower()
+            if sort not in SORT_COLUMNS:
+                raise ValueError(f"Unknown sort key '{sort}'")
+            filters['sort'] = sort
+        elif key in ['page', 'size', 'after']:
+            number = int(value)
+            if number < 1:
+                raise ValueError(f"{key} must be a positive number")
+            filters[key] = number
+        else:
+            raise ValueError(f"Unknown filter '{key}'")
+
+    filters['size'] = min(filters['size'], MAX_PAGE_SIZE)
+    return filters
+
+def format_filters(filters, **overrides):
+    """Render filters back to command arguments, e.g. for a 'next page' hint."""
+    filters = dict(filters, **overrides)
+    args = []
+    for key in ['chain', 'name']:
+        if filters.get(key):
+            args.append(f"{key}={filters[key]}")
+    if 'zone' in filters:
+        args.append(f"zone={'yes' if filters['zone'] else 'no'}")
+    if 'gain' in filters:
+        args.append(f"gain={filters['gain']:g}")
+    if filters['sort'] != 'added' or filters['descending']:
+        args.append(f"sort={'-' if filters['descending'] else ''}{filters['sort']}")
+    if filters['size'] != DEFAULT_PAGE_SIZE:
+        args.append(f"size={filters['size']}")
+    # With a keyset cursor the page number only labels the page; it is not used as an offset
+    if filters['page'] > 1:
+        args.append(f"page={filters['page']}")
+    if filters.get('after'):
+        args.append(f"after={filters['after']}")
+    return ' '.join(args)
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def build_token_query(columns, filters):
+    """Build the paginated SELECT for the given filters.
+
+    The default `added` order pages by keyset on `id` when an `after` cursor is
+    given; other sort keys use LIMIT/OFFSET with `id` as a tie-breaker. One extra
+    row is fetched to tell whether another page exists.
+    """
+    columns = list(dict.fromkeys(['id'] + list(columns)))
+    where = []
+    params = []
+
+    if filters.get('chain'):
+        where.append("chain = %s")
+        params.append(filters['chain'])
+    if filters.get('name'):
+        where.append("token_name LIKE %s")
+        params.append(_escape_like(filters['name']) + '%')
+    if 'zone' in filters:
+        where.append("buy_zone_notified_at IS NOT NULL" if filters['zone'] else "buy_zone_notified_at IS NULL")
+    if 'gain' in filters:
+        where.append("last_notified_multiple >= %s")
+        params.append(filters['gain'])
+
+    direction = 'DESC' if filters['descending'] else 'ASC'
+    sort_column = SORT_COLUMNS[filters['sort']]
+    keyset = sort_column == 'id' and filters.get('after')
+    if keyset:
+        where.append("id < %s" if filters['descending'] else "id > %s")
+        params.append(filters['after'])
+
+    query = f"SELECT {', '.join(columns)} FROM token_details"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    if sort_column == 'id':
+        query += f" ORDER BY id {direction}"
+    else:
+        query += f" ORDER BY {sort_column} {direction}, id {direction}"
+
+    query += " LIMIT %s"
+    params.append(filters['size'] + 1)
+    if not keyset:
+        query += " OFFSET %s"
+        params.append((filters['page'] - 1) * filters['size'])
+    return query, params
+
+def fetch_token_page(columns, filters):
+    """Return (rows, has_more) for one page of tokens matching the filters."""
+    query, params = build_token_query(columns, filters)
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+    has_more = len(rows) > filters['size']
+    return rows[:filters['size']], has_more
+
+def next_page_filters(filters, rows):
+    """Filters for the page after `rows`, using the keyset cursor where possible."""
+    if SORT_COLUMNS[filters['sort']] == 'id' and rows:
+        return dict(filters, after=rows[-1]['id'], page=filters['page'] + 1)
+    return dict(filters, page=filters['page'] + 1)
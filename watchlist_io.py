@@ -0,0 +1,306 @@
+import os
+import csv
+import json
+import math
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import mysql.connector
+from dotenv import load_dotenv
+import requests
+from singleflight import SingleFlight
+
+# Load environment variables from .env file
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# DexScreener API URL (accepts up to 30 comma-separated addresses per call)
+DEXSCREENER_API_URL = "https://api.dexscreener.com/latest/dex/tokens/"
+DEXSCREENER_BATCH_SIZE = 30
+DEXSCREENER_WORKERS = 8
+
+# Rows per multi-row INSERT statement and per fetch while exporting
+INSERT_CHUNK_SIZE = 500
+EXPORT_FETCH_SIZE = 1000
+
+# Columns accepted by /import, in the same order as the /start conversation
+IMPORT_FIELDS = [
+    'token_name', 'contract_address', 'try_buy_at_min', 'try_buy_at_max', 'chain',
+    'liquidity_locked', 'ownership_renounced', 'liquidity_burned',
+    'buy_tax', 'sell_tax', 'transfer_tax',
+]
+YES_NO_FIELDS = ['liquidity_locked', 'ownership_renounced', 'liquidity_burned']
+NUMERIC_FIELDS = ['buy_tax', 'sell_tax', 'transfer_tax', 'try_buy_at_min', 'try_buy_at_max']
+
+EXPORT_FIELDS = IMPORT_FIELDS + ['initial_market_cap']
+
+# Concurrent lookups of the same contract share one outstanding DexScreener request
+market_cap_flight = SingleFlight()
+
+def market_cap_key(chain, contract_address):
+    """Key identifying a contract lookup; EVM addresses are case-insensitive."""
+    contract_address = contract_address.strip()
+    if contract_address.lower().startswith('0x'):
+        contract_address = contract_address.lower()
+    return (chain or '').strip().lower(), contract_address
+
+def get_db_connection():
+    return mysql.connector.connect(
+        host=os.getenv('DB_HOST'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME')
+    )
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt.lower()
+    return 'json' if path.lower().endswith('.json') else 'csv'
+
+# ----- VALIDATION -----
+def validate_row(row: dict):
+    """Return (token, None) for a valid row or (None, reason) for an invalid one."""
+    token = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if value is None or str(value).strip() == '':
+            return None, f"missing {field}"
+        value = str(value).strip()
+
+        if field in NUMERIC_FIELDS:
+            try:
+                value = float(value)
+            except ValueError:
+                return None, f"{field} is not a number: {value}"
+            if not math.isfinite(value):
+                return None, f"{field} must be a finite number: {value}"
+        elif field in YES_NO_FIELDS:
+            value = value.lower()
+            if value not in ['yes', 'no']:
+                return None, f"{field} must be 'yes' or 'no'"
+        token[field] = value
+
+    if token['try_buy_at_min'] > token['try_buy_at_max']:
+        return None, "try_buy_at_min is greater than try_buy_at_max"
+    return token, None
+
+def read_rows(path, fmt=None):
+    fmt = detect_format(path, fmt)
+    if fmt == 'json':
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            data = data.get('tokens', [])
+        if not isinstance(data, list):
+            raise ValueError("JSON import must be a list of tokens or an object with a 'tokens' list")
+        for row in data:
+            yield row if isinstance(row, dict) else {}
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                yield row
+
+def load_tokens(path, fmt=None):
+    """Validate every row of an import file, dropping duplicate contract addresses."""
+    tokens = []
+    errors = []
+    seen = set()
+    for line_number, row in enumerate(read_rows(path, fmt), start=1):
+        token, error = validate_row(row)
+        if error:
+            errors.append(f"Row {line_number}: {error}")
+            continue
+        key = token['contract_address'].lower()
+        if key in seen:
+            errors.append(f"Row {line_number}: duplicate contract address {token['contract_address']}")
+            continue
+        seen.add(key)
+        tokens.append(token)
+    return tokens, errors
+
+# ----- BATCHED MARKET CAP LOOKUP -----
+def fetch_market_cap_batch(contract_addresses):
+    """Fetch market caps for up to DEXSCREENER_BATCH_SIZE contracts in one request."""
+    market_caps = {}
+    try:
+        response = requests.get(f"{DEXSCREENER_API_URL}{','.join(contract_addresses)}", timeout=30)
+        if response.status_code != 200:
+            logger.error(f"Failed to fetch batch from DexScreener: {response.status_code}")
+            return market_caps
+
+        pairs = response.json().get('pairs') or []
+        for pair in pairs:
+            address = pair.get('baseToken', {}).get('address', '').lower()
+            if address and address not in market_caps and 'marketCap' in pair:
+                market_caps[address] = float(pair['marketCap'])
+    except Exception as e:
+        logger.error(f"Error fetching market cap batch: {e}")
+    return market_caps
+
+def _fetch_market_caps_for_keys(keys):
+    addresses = list(dict.fromkeys(address for _, address in keys))
+    batches = [addresses[i:i + DEXSCREENER_BATCH_SIZE] for i in range(0, len(addresses), DEXSCREENER_BATCH_SIZE)]
+    by_address = {}
+    with ThreadPoolExecutor(max_workers=min(DEXSCREENER_WORKERS, len(batches))) as executor:
+        for result in executor.map(fetch_market_cap_batch, batches):
+            by_address.update(result)
+    logger.info(f"Resolved market caps for {len(by_address)}/{len(addresses)} contracts in {len(batches)} requests")
+    return {key: by_address.get(key[1].lower()) for key in keys}
+
+def fetch_market_caps(contracts):
+    """Resolve market caps for many (chain, contract_address) pairs using concurrent batched requests.
+
+    Contracts already being fetched elsewhere in this process are shared rather
+    than requested again. Returns a dict keyed by `market_cap_key`; contracts
+    without a market cap map to None.
+    """
+    keys = [market_cap_key(chain, address) for chain, address in contracts]
+    if not keys:
+        return {}
+    return market_cap_flight.do_many(keys, _fetch_market_caps_for_keys)
+
+# ----- BULK INSERT -----
+def existing_contract_addresses(cursor, contract_addresses):
+    existing = set()
+    for i in range(0, len(contract_addresses), INSERT_CHUNK_SIZE):
+        chunk = contract_addresses[i:i + INSERT_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT contract_address FROM token_details WHERE contract_address IN ({placeholders})", chunk)
+        existing.update(row[0].lower() for row in cursor.fetchall())
+    return existing
+
+def bulk_insert_tokens(tokens, market_caps, conn, announce=False):
+    """Insert tokens with multi-row INSERT statements inside a single transaction.
+
+    Unless `announce` is set, rows are stored as already notified so bot1 does not
+    post a separate new-token message for each imported token.
+    """
+    columns = IMPORT_FIELDS + ['initial_market_cap']
+    notified_at = 'NULL' if announce else 'UTC_TIMESTAMP()'
+    row_placeholder = f"({', '.join(['%s'] * len(columns))}, NOW(), {notified_at})"
+    cursor = conn.cursor()
+    try:
+        for i in range(0, len(tokens), INSERT_CHUNK_SIZE):
+            chunk = tokens[i:i + INSERT_CHUNK_SIZE]
+            insert_query = (
+                f"INSERT INTO token_details ({', '.join(columns)}, timestamp, notified_at) VALUES "
+                + ', '.join([row_placeholder] * len(chunk))
+            )
+            values = []
+            for token in chunk:
+                values.extend(token[field] for field in IMPORT_FIELDS)
+                values.append(market_caps.get(market_cap_key(token['chain'], token['contract_address'])))
+            cursor.execute(insert_query, values)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def import_tokens(path, fmt=None, announce=False):
+    """Validate, enrich and insert an import file.
+
+    Returns (inserted tokens, number skipped as already present, errors).
+    """
+    tokens, errors = load_tokens(path, fmt)
+    if not tokens:
+        return [], 0, errors
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            existing = existing_contract_addresses(cursor, [t['contract_address'] for t in tokens])
+        finally:
+            cursor.close()
+
+        new_tokens = [t for t in tokens if t['contract_address'].lower() not in existing]
+        skipped = len(tokens) - len(new_tokens)
+        market_caps = fetch_market_caps([(t['chain'], t['contract_address']) for t in new_tokens])
+        bulk_insert_tokens(new_tokens, market_caps, conn, announce)
+        logger.info(f"Imported {len(new_tokens)} tokens from {path} ({skipped} already present)")
+        return new_tokens, skipped, errors
+    finally:
+        if conn:
+            conn.close()
+
+# ----- STREAMING EXPORT -----
+def _export_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def iter_token_rows():
+    """Yield token_details rows in batches from an unbuffered cursor."""
+    conn = None
+    cursor = None
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"SELECT {', '.join(EXPORT_FIELDS)} FROM token_details ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield {field: _export_value(row[field]) for field in EXPORT_FIELDS}
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def export_tokens(out, fmt='csv'):
+    """Write every token to the open text file `out`. Returns the number of rows written."""
+    count = 0
+    if fmt == 'json':
+        out.write('[')
+        for row in iter_token_rows():
+            out.write((',\n' if count else '\n') + json.dumps(row))
+            count += 1
+        out.write('\n]\n')
+    else:
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+        for row in iter_token_rows():
+            writer.writerow(row)
+            count += 1
+    return count
+
+# ----- CLI -----
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Bulk import/export of the MavBot watchlist.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Import tokens from a CSV or JSON file")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=['csv', 'json'])
+    import_parser.add_argument('--announce', action='store_true',
+                               help="Let bot1 post a new-token message for every imported token")
+
+    export_parser = subparsers.add_parser('export', help="Export tokens to a CSV or JSON file")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=['csv', 'json'])
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        inserted, skipped, errors = import_tokens(args.path, args.format, args.announce)
+        for error in errors:
+            print(error)
+        print(f"Inserted {len(inserted)} tokens, skipped {skipped} already in the watchlist, {len(errors)} invalid rows.")
+    else:
+        with open(args.path, 'w', newline='', encoding='utf-8') as out:
+            count = export_tokens(out, detect_format(args.path, args.format))
+        print(f"Exported {count} tokens to {args.path}.")
+
+if __name__ == '__main__':
+    main()